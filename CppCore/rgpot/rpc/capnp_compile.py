@@ -7,15 +7,19 @@ This wrapper renames the generated source so that all compilers can
 consume it without extra flags.
 """
 import os
-import shutil
 import subprocess
 import sys
 
 capnp, outdir, src_prefix, schema = sys.argv[1:5]
-subprocess.check_call([capnp, "compile", f"-oc++:{outdir}", f"--src-prefix={src_prefix}", schema])
+subprocess.run(
+    [capnp, "compile", f"-oc++:{outdir}", f"--src-prefix={src_prefix}", schema],
+    check=True,
+    stdout=subprocess.DEVNULL,
+)
 
 base = os.path.splitext(os.path.basename(schema))[0]  # e.g. "Potentials"
 old = os.path.join(outdir, f"{base}.capnp.c++")
 new = os.path.join(outdir, f"{base}.capnp.cpp")
 if os.path.exists(old):
-    shutil.move(old, new)
+    # Atomic rename, and never falls back to a cross-device copy
+    os.replace(old, new)
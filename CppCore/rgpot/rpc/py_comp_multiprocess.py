@@ -6,6 +6,8 @@
 # dependencies = [
 #   "pycapnp",
 #   "ase",
+#   "matplotlib",
+#   "uvloop; sys_platform != 'win32'",
 # ]
 # ///
 
@@ -15,21 +17,25 @@
 # ./bbdir/CppCore/rgpot/rpc/potserv 12346 LJ
 # ./bbdir/CppCore/rgpot/rpc/potserv 12347 LJ
 # 2. Run client
-# uv run CppCore/rgpot/rpc/py_parclient.py \
+# uv run CppCore/rgpot/rpc/py_comp_multiprocess.py \
 #        localhost:12345 \
 #        localhost:12346 \
 #        localhost:12347
 
 import argparse
-import asyncio
+import json
+import multiprocessing
 import time
 from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.shared_memory import SharedMemory
 
-import capnp
-import matplotlib.pyplot as plt
-import Potentials_capnp
+import numpy as np
+from ase import Atoms
 from ase.build import bulk, molecule
 from ase.calculators.lj import LennardJones
+from rpc_bench import add_benchmark_options, load_pyplot, time_rpc_benchmark
+from rpc_marshal import structures_to_payloads
+from rpc_pool import run_capnp
 
 
 def parse_args():
@@ -42,72 +48,70 @@ def parse_args():
         nargs="+",
         help="List of server addresses in HOST:PORT format for the RPC pool.",
     )
+    add_benchmark_options(parser)
     return parser.parse_args()
 
 
-def atoms_to_force_input(atoms):
-    """Converts an ASE Atoms object to a Cap'n Proto ForceInput message."""
-    force_input = Potentials_capnp.ForceInput.new_message()
-    force_input.natm = len(atoms)
-    positions = atoms.get_positions().flatten()
-    pos_list = force_input.init("pos", len(positions))
-    for i, pos in enumerate(positions):
-        pos_list[i] = float(pos)
-    atom_types = atoms.get_atomic_numbers()
-    atom_list = force_input.init("atmnrs", len(atom_types))
-    for i, atom_type in enumerate(atom_types):
-        atom_list[i] = int(atom_type)
-    box_matrix = atoms.get_cell().flatten()
-    box_list = force_input.init("box", len(box_matrix))
-    for i, val in enumerate(box_matrix):
-        box_list[i] = float(val)
-    return force_input
-
-
 # --- Functions for the "Traditional" MPI-style Parallelism ---
 
 
-def run_local_lj_calculation(atoms):
-    """A simple function to be run in a separate process."""
-    calc = LennardJones()
-    atoms.calc = calc
-    return atoms.get_potential_energy()
-
-
-# --- Functions for the RPC/Service Model Parallelism ---
-
-
-async def run_single_rpc_calculation_async(host, port, atoms_obj, structure_name):
-    """The core async function to run one RPC calculation."""
-    try:
-        connection = await capnp.AsyncIoStream.create_connection(host=host, port=port)
-        client = capnp.TwoPartyClient(connection)
-        calculator = client.bootstrap().cast_as(Potentials_capnp.Potential)
-        force_input = atoms_to_force_input(atoms_obj)
-        response = await calculator.calculate(force_input)
-        energy = response.result.energy
-        print(
-            f"  => RPC Result from {host}:{port} for {structure_name}: Energy = {energy:.4f}"
+#: Size of the local process pool.
+LOCAL_WORKERS = 4
+
+# Per-worker state, set up once by _init_worker rather than per task
+_LJ_CALC = None
+_SHARED_BLOCKS = {}
+_WARM_UP_BARRIER = None
+
+
+def _init_worker(warm_up_barrier):
+    """Process pool initializer, builds the LJ calculator once per worker."""
+    global _LJ_CALC, _WARM_UP_BARRIER
+    _LJ_CALC = LennardJones()
+    _WARM_UP_BARRIER = warm_up_barrier
+
+
+def _warm_up_worker(_):
+    """Task used to start a pool worker ahead of the timed region."""
+    # Blocking until LOCAL_WORKERS tasks wait here at once forces the
+    # executor to hand each warm-up task to a separate worker.
+    _WARM_UP_BARRIER.wait()
+
+
+def pack_positions(structures):
+    """Copies every structure's positions into a single shared memory block.
+
+    Returns the block and, per structure name, the small task tuple a worker
+    needs to rebuild it, so only offsets and metadata are pickled per task.
+    """
+    total_bytes = sum(len(atoms) * 3 * 8 for atoms in structures.values())
+    shm = SharedMemory(create=True, size=max(total_bytes, 1))
+    tasks = {}
+    offset = 0
+    for name, atoms in structures.items():
+        positions = atoms.get_positions()
+        np.ndarray(positions.shape, np.float64, shm.buf, offset)[:] = positions
+        tasks[name] = (
+            shm.name,
+            offset,
+            atoms.get_atomic_numbers(),
+            atoms.get_cell().array,
+            atoms.get_pbc(),
         )
-        return structure_name, energy
-    except Exception as e:
-        print(f"  => RPC Error for {structure_name} on {host}:{port}: {e}")
-        return structure_name, None
-
-
-async def run_all_rpc_calculations_concurrently(hosts, structures):
-    """Main coroutine for the RPC benchmark."""
-    server_addresses = [host.split(":") for host in hosts]
-    tasks = []
-    for i, (name, atoms) in enumerate(structures.items()):
-        host, port = server_addresses[i % len(server_addresses)]
-        task = asyncio.create_task(
-            run_single_rpc_calculation_async(host, int(port), atoms, name)
-        )
-        tasks.append(task)
-
-    results = await asyncio.gather(*tasks)
-    return dict(results)
+        offset += positions.nbytes
+    return shm, tasks
+
+
+def run_local_lj_calculation(task):
+    """Rebuilds one structure from shared memory and evaluates it in a worker."""
+    shm_name, offset, numbers, cell, pbc = task
+    shm = _SHARED_BLOCKS.get(shm_name)
+    if shm is None:
+        shm = _SHARED_BLOCKS[shm_name] = SharedMemory(name=shm_name)
+    positions = np.ndarray((len(numbers), 3), np.float64, shm.buf, offset)
+    atoms = Atoms(numbers=numbers, positions=positions, cell=cell, pbc=pbc)
+    atoms.calc = _LJ_CALC
+    return atoms.get_potential_energy()
 
 
 # --- Plotting ---
@@ -115,6 +119,8 @@ async def run_all_rpc_calculations_concurrently(hosts, structures):
 
 def create_plots(labels, mpi_times, rpc_times):
     """Generates a plot comparing the total execution time of the two parallel models."""
+    plt = load_pyplot()
+
     fig, ax = plt.subplots(figsize=(10, 7))
 
     approaches = ["ProcessPool", "Parallel RPC Pool"]
@@ -164,28 +170,47 @@ def main():
     for _, atoms in structures.items():
         atoms.set_cell([90, 90, 90])
         atoms.center()
+    payloads = structures_to_payloads(structures)
     print(f"Generated {len(structures)} structures to calculate.\n")
 
     # --- Benchmark 1: Parallel Local Calculation (MPI-style) ---
     print(
         f"--- BENCHMARK 1: Running {len(structures)} local calculations in a Process Pool ---"
     )
-    start_time_mpi = time.monotonic()
     local_results = {}
-    with ProcessPoolExecutor(max_workers=4) as executor:
-        future_to_name = {
-            executor.submit(run_local_lj_calculation, atoms): name
-            for name, atoms in structures.items()
-        }
-        for future in as_completed(future_to_name):
-            name = future_to_name[future]
-            try:
-                energy = future.result()
-                local_results[name] = energy
-                print(f"  Local Result for {name}: Energy = {energy:.4f}")
-            except Exception as exc:
-                print(f"  Local task for {name} generated an exception: {exc}")
-    end_time_mpi = time.monotonic()
+    # forkserver workers start from a clean, pre-imported server process
+    # instead of forking the full parent; not available on Windows.
+    mp_context = multiprocessing.get_context(
+        "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else None
+    )
+    shm, lj_tasks = pack_positions(structures)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=LOCAL_WORKERS,
+            mp_context=mp_context,
+            initializer=_init_worker,
+            initargs=(mp_context.Barrier(LOCAL_WORKERS),),
+        ) as executor:
+            # Start every worker, including its re-import of this script,
+            # before the clock starts so only submit and collect are timed.
+            list(executor.map(_warm_up_worker, range(LOCAL_WORKERS)))
+            start_time_mpi = time.monotonic()
+            future_to_name = {
+                executor.submit(run_local_lj_calculation, task): name
+                for name, task in lj_tasks.items()
+            }
+            for future in as_completed(future_to_name):
+                name = future_to_name[future]
+                try:
+                    energy = future.result()
+                    local_results[name] = energy
+                    print(f"  Local Result for {name}: Energy = {energy:.4f}")
+                except Exception as exc:
+                    print(f"  Local task for {name} generated an exception: {exc}")
+            end_time_mpi = time.monotonic()
+    finally:
+        shm.close()
+        shm.unlink()
     total_time_mpi = end_time_mpi - start_time_mpi
     print(
         f"\nParallel Local (MPI-style) execution took: {total_time_mpi:.4f} seconds\n"
@@ -195,12 +220,9 @@ def main():
     print(
         f"--- BENCHMARK 2: Running {len(structures)} calculations concurrently against RPC Pool ---"
     )
-    start_time_rpc = time.monotonic()
-    # This pattern correctly starts the event loop for the RPC calls.
-    main_coro = run_all_rpc_calculations_concurrently(args.hosts, structures)
-    rpc_results = asyncio.run(capnp.run(main_coro))
-    end_time_rpc = time.monotonic()
-    total_time_rpc = end_time_rpc - start_time_rpc
+    rpc_results, total_time_rpc = run_capnp(
+        time_rpc_benchmark(args.hosts, payloads, batch=args.batch)
+    )
     print(f"\nParallel RPC Pool execution took: {total_time_rpc:.4f} seconds\n")
 
     # --- Summary and Plotting ---
@@ -215,7 +237,13 @@ def main():
             slowdown = total_time_rpc / total_time_mpi
             print(f"RPC Pool was {slowdown:.2f}x slower.")
 
-    create_plots(["ProcessPoolExecutor", "RPC Pool"], [total_time_mpi], [total_time_rpc])
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump({"processpool": total_time_mpi, "rpc": total_time_rpc}, fh, indent=2)
+    if not args.no_plot:
+        create_plots(
+            ["ProcessPoolExecutor", "RPC Pool"], [total_time_mpi], [total_time_rpc]
+        )
 
 
 if __name__ == "__main__":
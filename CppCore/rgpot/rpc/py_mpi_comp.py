@@ -5,20 +5,23 @@
 # dependencies = [
 #   "pycapnp",
 #   "ase",
+#   "matplotlib",
+#   "uvloop; sys_platform != 'win32'",
 #   "mpi4py",
 # ]
 # ///
 
 import argparse
-import asyncio
-import time
+import json
 
-import capnp
-import matplotlib.pyplot as plt
-import Potentials_capnp
+import numpy as np
+from ase import Atoms
 from ase.build import bulk, molecule
 from ase.calculators.lj import LennardJones
 from mpi4py import MPI
+from rpc_bench import add_benchmark_options, load_pyplot, time_rpc_benchmark
+from rpc_marshal import structures_to_payloads
+from rpc_pool import run_capnp
 
 
 def parse_args():
@@ -32,72 +35,64 @@ def parse_args():
         default=[],
         help="List of server addresses in HOST:PORT format for the RPC pool.",
     )
+    add_benchmark_options(parser)
     return parser.parse_args()
 
 
-def atoms_to_force_input(atoms):
-    """Converts an ASE Atoms object to a Cap'n Proto ForceInput message."""
-    force_input = Potentials_capnp.ForceInput.new_message()
-    force_input.natm = len(atoms)
-    positions = atoms.get_positions().flatten()
-    pos_list = force_input.init("pos", len(positions))
-    for i, pos in enumerate(positions):
-        pos_list[i] = float(pos)
-    atom_types = atoms.get_atomic_numbers()
-    atom_list = force_input.init("atmnrs", len(atom_types))
-    for i, atom_type in enumerate(atom_types):
-        atom_list[i] = int(atom_type)
-    box_matrix = atoms.get_cell().flatten()
-    box_list = force_input.init("box", len(box_matrix))
-    for i, val in enumerate(box_matrix):
-        box_list[i] = float(val)
-    return force_input
-
-
 # --- Functions for the "Traditional" MPI-style Parallelism ---
 
 
-def run_local_lj_calculation(atoms):
+def run_local_lj_calculation(atoms, calc):
     """A simple function to be run in a separate MPI process."""
-    calc = LennardJones()
     atoms.calc = calc
     return atoms.get_potential_energy()
 
 
-# --- Functions for the RPC/Service Model Parallelism ---
-
-
-async def run_single_rpc_calculation_async(host, port, atoms_obj, structure_name):
-    """The core async function to run one RPC calculation."""
-    try:
-        connection = await capnp.AsyncIoStream.create_connection(host=host, port=port)
-        client = capnp.TwoPartyClient(connection)
-        calculator = client.bootstrap().cast_as(Potentials_capnp.Potential)
-        force_input = atoms_to_force_input(atoms_obj)
-        response = await calculator.calculate(force_input)
-        energy = response.result.energy
-        print(
-            f"  => RPC Result from {host}:{port} for {structure_name}: Energy = {energy:.4f}"
-        )
-        return structure_name, energy
-    except Exception as e:
-        print(f"  => RPC Error for {structure_name} on {host}:{port}: {e}")
-        return structure_name, None
-
-
-async def run_all_rpc_calculations_concurrently(hosts, structures):
-    """Main coroutine for the RPC benchmark."""
-    server_addresses = [host.split(":") for host in hosts]
-    tasks = []
-    for i, (name, atoms) in enumerate(structures.items()):
-        host, port = server_addresses[i % len(server_addresses)]
-        task = asyncio.create_task(
-            run_single_rpc_calculation_async(host, int(port), atoms, name)
+def buffer_spec(buf, counts, mpi_type):
+    """Builds a Scatterv/Gatherv buffer spec from per-rank element counts."""
+    displs = np.zeros_like(counts)
+    np.cumsum(counts[:-1], out=displs[1:])
+    return [buf, counts, displs, mpi_type]
+
+
+def pack_chunks(chunked_tasks):
+    """Flattens per-rank chunks of (name, atoms) into arrays for Scatterv.
+
+    Structures are laid out rank by rank, so each rank's share of every array
+    is one contiguous slice. Returns the structure names in that order, the
+    packed arrays, and the per-rank structure and atom counts.
+    """
+    ordered = [item for chunk in chunked_tasks for item in chunk]
+    names = [name for name, _ in ordered]
+    atoms_list = [atoms for _, atoms in ordered]
+    packed = {
+        "natoms": np.array([len(atoms) for atoms in atoms_list], dtype=np.int32),
+        "pos": np.concatenate([a.get_positions().ravel() for a in atoms_list]),
+        "numbers": np.concatenate(
+            [a.get_atomic_numbers() for a in atoms_list]
+        ).astype(np.int32),
+        "cell": np.concatenate([a.get_cell().array.ravel() for a in atoms_list]),
+        "pbc": np.concatenate([a.get_pbc() for a in atoms_list]).astype(np.uint8),
+    }
+    struct_counts = np.array([len(chunk) for chunk in chunked_tasks], dtype=np.int32)
+    atom_counts = np.array(
+        [sum(len(atoms) for _, atoms in chunk) for chunk in chunked_tasks],
+        dtype=np.int32,
+    )
+    return names, packed, struct_counts, atom_counts
+
+
+def unpack_structures(natoms, pos, numbers, cell, pbc):
+    """Rebuilds ASE Atoms objects from the flat arrays received by a rank."""
+    bounds = np.concatenate(([0], np.cumsum(natoms)))
+    positions = pos.reshape(-1, 3)
+    cells = cell.reshape(-1, 3, 3)
+    pbcs = pbc.reshape(-1, 3).astype(bool)
+    for i in range(len(natoms)):
+        lo, hi = bounds[i], bounds[i + 1]
+        yield Atoms(
+            numbers=numbers[lo:hi], positions=positions[lo:hi], cell=cells[i], pbc=pbcs[i]
         )
-        tasks.append(task)
-
-    results = await asyncio.gather(*tasks)
-    return dict(results)
 
 
 # --- Plotting ---
@@ -105,6 +100,8 @@ async def run_all_rpc_calculations_concurrently(hosts, structures):
 
 def create_plots(mpi_time, rpc_time):
     """Generates a plot comparing the total execution time of the two parallel models."""
+    plt = load_pyplot()
+
     fig, ax = plt.subplots(figsize=(10, 7))
 
     approaches = ["Parallel Local (mpi4py)", "Parallel RPC Pool"]
@@ -159,9 +156,10 @@ def main():
         for _, atoms in structures.items():
             atoms.set_cell([90, 90, 90])
             atoms.center()
+        payloads = structures_to_payloads(structures)
         print(f"Generated {len(structures)} structures to calculate.\n")
 
-        # Manually split tasks for each process. This avoids the numpy error.
+        # Manually split tasks for each process.
         tasks = list(structures.items())
         # This creates a list of lists, e.g., [[task1, task2], [task3, task4], ...]
         chunked_tasks = [tasks[i::size] for i in range(size)]
@@ -178,26 +176,56 @@ def main():
             f"--- [Rank 0] BENCHMARK 1: Distributing {len(tasks)} tasks to {size} MPI processes ---"
         )
         start_time_mpi = MPI.Wtime()
+        # Flat NumPy buffers go through the buffer-based Scatterv/Gatherv
+        # path instead of pickling every Atoms object.
+        names, packed, struct_counts, atom_counts = pack_chunks(chunked_tasks)
+        local_counts_send = [np.stack([struct_counts, atom_counts], axis=1), MPI.INT]
+    else:
+        local_counts_send = None
+
+    # Each process learns how many structures and atoms it receives ...
+    local_counts = np.empty(2, dtype=np.int32)
+    comm.Scatter(local_counts_send, [local_counts, MPI.INT], root=0)
+    n_local, natoms_local = local_counts
+
+    # ... and then receives its chunk of every packed array from rank 0
+    fields = (
+        ("natoms", n_local, np.int32, MPI.INT, 1, "struct"),
+        ("pos", 3 * natoms_local, np.float64, MPI.DOUBLE, 3, "atom"),
+        ("numbers", natoms_local, np.int32, MPI.INT, 1, "atom"),
+        ("cell", 9 * n_local, np.float64, MPI.DOUBLE, 9, "struct"),
+        ("pbc", 3 * n_local, np.uint8, MPI.UNSIGNED_CHAR, 3, "struct"),
+    )
+    local_data = {}
+    for key, length, dtype, mpi_type, width, per in fields:
+        recvbuf = np.empty(length, dtype=dtype)
+        sendbuf = None
+        if rank == 0:
+            counts = width * (struct_counts if per == "struct" else atom_counts)
+            sendbuf = buffer_spec(packed[key], counts, mpi_type)
+        comm.Scatterv(sendbuf, [recvbuf, mpi_type], root=0)
+        local_data[key] = recvbuf
+
+    # All processes (including rank 0) do their share of the work, reusing
+    # one calculator per rank for every structure in the chunk
+    calc = LennardJones()
+    local_energies = np.array(
+        [
+            run_local_lj_calculation(atoms, calc)
+            for atoms in unpack_structures(**local_data)
+        ],
+        dtype=np.float64,
+    )
 
-    # Each process receives its chunk of tasks from rank 0
-    local_tasks = comm.scatter(chunked_tasks, root=0)
-
-    # All processes (including rank 0) do their share of the work
-    local_results = {
-        name: run_local_lj_calculation(atoms) for name, atoms in local_tasks
-    }
-
-    # Gather results back to the master process
-    all_results_list = comm.gather(local_results, root=0)
+    # Gather the energies back to the master process
+    energies = np.empty(len(tasks), dtype=np.float64) if rank == 0 else None
+    recv_spec = buffer_spec(energies, struct_counts, MPI.DOUBLE) if rank == 0 else None
+    comm.Gatherv([local_energies, MPI.DOUBLE], recv_spec, root=0)
 
     if rank == 0:
         end_time_mpi = MPI.Wtime()
         total_time_mpi = end_time_mpi - start_time_mpi
-        # Combine results from all processes into a single dictionary
-        all_mpi_results = {}
-        if all_results_list:
-            for res_dict in all_results_list:
-                all_mpi_results.update(res_dict)
+        all_mpi_results = dict(zip(names, energies.tolist()))
         print(
             f"\nParallel Local (mpi4py) execution took: {total_time_mpi:.4f} seconds\n"
         )
@@ -210,11 +238,9 @@ def main():
             print(
                 f"--- [Rank 0] BENCHMARK 2: Running {len(tasks)} calculations concurrently against RPC Pool ---"
             )
-            start_time_rpc = time.monotonic()
-            main_coro = run_all_rpc_calculations_concurrently(args.hosts, structures)
-            rpc_results = asyncio.run(capnp.run(main_coro))
-            end_time_rpc = time.monotonic()
-            total_time_rpc = end_time_rpc - start_time_rpc
+            rpc_results, total_time_rpc = run_capnp(
+                time_rpc_benchmark(args.hosts, payloads, batch=args.batch)
+            )
             print(f"\nParallel RPC Pool execution took: {total_time_rpc:.4f} seconds\n")
 
         # --- Summary and Plotting (only on Rank 0) ---
@@ -229,7 +255,11 @@ def main():
                 slowdown = total_time_rpc / total_time_mpi
                 print(f"RPC Pool was {slowdown:.2f}x slower.")
 
-        create_plots(total_time_mpi, total_time_rpc)
+        if args.json:
+            with open(args.json, "w") as fh:
+                json.dump({"mpi": total_time_mpi, "rpc": total_time_rpc}, fh, indent=2)
+        if not args.no_plot:
+            create_plots(total_time_mpi, total_time_rpc)
 
 
 if __name__ == "__main__":
@@ -5,6 +5,8 @@
 # dependencies = [
 #   "pycapnp",
 #   "ase",
+#   "matplotlib",
+#   "uvloop; sys_platform != 'win32'",
 # ]
 # ///
 
@@ -19,18 +21,27 @@
 #        localhost:12346 \
 #        localhost:12347
 
-#!/usr/bin/env python3
-
 import argparse
 import asyncio
+import json
+import multiprocessing
+import os
 import time
+from concurrent.futures import ProcessPoolExecutor
 
-import capnp
-import matplotlib.pyplot as plt
 import numpy as np
-import Potentials_capnp
 from ase.build import bulk, molecule
 from ase.calculators.lj import LennardJones
+from rpc_marshal import structures_to_payloads
+from rpc_pool import CapnpChannelPool, run_capnp
+
+
+def positive_int(value):
+    """argparse type for options that must be at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
 
 
 def parse_args():
@@ -50,54 +61,85 @@ def parse_args():
         help="Milliseconds to sleep in the local ASE calculation to simulate a heavy workload. "
         "Set this to match the sleep duration in your C++ server for a fair comparison.",
     )
+    parser.add_argument(
+        "--connections-per-host",
+        type=positive_int,
+        default=1,
+        help="Number of persistent connections opened to each server.",
+    )
+    parser.add_argument(
+        "--inflight-per-server",
+        type=positive_int,
+        default=2,
+        help="Maximum concurrent requests per server in the parallel phase.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=positive_int,
+        default=1,
+        help="Structures per calculateBatch RPC in the parallel phase "
+        "(1 sends plain calculate calls; 2-4 keeps latency low).",
+    )
+    parser.add_argument(
+        "--no-plot",
+        action="store_true",
+        help="Skip plotting; matplotlib is then never imported.",
+    )
+    parser.add_argument(
+        "--json",
+        metavar="PATH",
+        help="Write the measured timings to PATH as JSON.",
+    )
     return parser.parse_args()
 
 
-def atoms_to_force_input(atoms):
-    """Converts an ASE Atoms object to a Cap'n Proto ForceInput message."""
-    force_input = Potentials_capnp.ForceInput.new_message()
-    force_input.natm = len(atoms)
-
-    positions = atoms.get_positions().flatten()
-    pos_list = force_input.init("pos", len(positions))
-    for i, pos in enumerate(positions):
-        pos_list[i] = float(pos)
-
-    atom_types = atoms.get_atomic_numbers()
-    atom_list = force_input.init("atmnrs", len(atom_types))
-    for i, atom_type in enumerate(atom_types):
-        atom_list[i] = int(atom_type)
-
-    box_matrix = atoms.get_cell().flatten()
-    box_list = force_input.init("box", len(box_matrix))
-    for i, val in enumerate(box_matrix):
-        box_list[i] = float(val)
-
-    return force_input
-
-
-async def run_single_calculation(host, port, atoms_obj, structure_name):
-    """Connects to a single server, runs one calculation, and returns the result."""
+async def run_single_calculation(channel, payload, structure_name):
+    """Runs one calculation on a pooled server channel and returns its energy."""
+    host, port = channel.host, channel.port
     try:
-        connection = await capnp.AsyncIoStream.create_connection(host=host, port=port)
-        client = capnp.TwoPartyClient(connection)
-        calculator = client.bootstrap().cast_as(Potentials_capnp.Potential)
-
-        force_input = atoms_to_force_input(atoms_obj)
-        response = await calculator.calculate(force_input)
+        request = channel.calculator.calculate_request()
+        request.fip = payload
+        response = await request.send()
 
+        # Read only the energy; the forces list is never converted, so its
+        # size does not add to the measured latency.
         energy = response.result.energy
         print(
             f"  => RPC Result from {host}:{port} for {structure_name}: Energy = {energy:.4f}"
         )
-        return response.to_dict()
+        return energy
     except Exception as e:
         print(f"  => RPC Error for {structure_name} on {host}:{port}: {e}")
         return None
 
 
-def create_timing_plot(results_data):
+async def run_batch_calculation(channel, batch):
+    """Runs ``(name, payload)`` pairs in one calculateBatch call; returns (name, energy) pairs."""
+    host, port = channel.host, channel.port
+    names = [name for name, _ in batch]
+    try:
+        request = channel.calculator.calculateBatch_request()
+        inputs = request.init("inputs", len(batch))
+        for i, (_, payload) in enumerate(batch):
+            inputs[i] = payload
+        response = await request.send()
+
+        pairs = []
+        for name, result in zip(names, response.results):
+            energy = result.energy
+            print(f"  => RPC Result from {host}:{port} for {name}: Energy = {energy:.4f}")
+            pairs.append((name, energy))
+        return pairs
+    except Exception as e:
+        print(f"  => RPC Error for batch {names} on {host}:{port}: {e}")
+        return [(name, None) for name in names]
+
+
+def create_timing_plot(results_data, sleep_ms):
     """Generates a plot comparing the per-task execution times."""
+    # Imported here so the benchmark itself never pays matplotlib's import cost
+    import matplotlib.pyplot as plt
+
     labels = list(results_data.keys())
     local_times = [r["local_time_ms"] for r in results_data.values()]
     rpc_times = [r["rpc_time_ms"] for r in results_data.values()]
@@ -110,7 +152,7 @@ def create_timing_plot(results_data):
         x - width / 2,
         local_times,
         width,
-        label=f"Local ASE Call (+{args.sleep_ms}ms sleep)",
+        label=f"Local ASE Call (+{sleep_ms}ms sleep)",
     )
     rects2 = ax.bar(
         x + width / 2, rpc_times, width, label="C++ RPC Call (includes network)"
@@ -128,10 +170,133 @@ def create_timing_plot(results_data):
     print("\nSaved detailed timing comparison plot to 'per_task_timing_comparison.png'")
 
 
-async def main(hosts, sleep_ms):
-    """Main coroutine to orchestrate sequential and parallel calculations."""
-    server_addresses = [host.split(":") for host in hosts]
+def reference_energy(atoms):
+    """Evaluates ``atoms`` with ASE's LJ calculator; returns (energy, seconds)."""
+    atoms.calc = LennardJones()
+    t0 = time.monotonic()
+    ref_energy = atoms.get_potential_energy()
+    return ref_energy, time.monotonic() - t0
+
+
+async def compute_reference_energies(structures):
+    """Evaluates every structure with ASE's LJ calculator in a process pool.
+
+    Returns ``{name: (energy, seconds)}``. ASE's LJ calculator is pure
+    Python, so the structures are spread over worker processes instead of
+    being evaluated one after another on the event loop thread.
+    """
+    loop = asyncio.get_running_loop()
+    # Never fork the process holding the live capnp connections.
+    mp_context = multiprocessing.get_context(
+        "forkserver"
+        if "forkserver" in multiprocessing.get_all_start_methods()
+        else "spawn"
+    )
+    with ProcessPoolExecutor(
+        max_workers=min(len(structures), os.cpu_count() or 1),
+        mp_context=mp_context,
+    ) as executor:
+        energies = await asyncio.gather(
+            *(
+                loop.run_in_executor(executor, reference_energy, atoms)
+                for atoms in structures.values()
+            )
+        )
+    return dict(zip(structures, energies))
+
+
+async def run_sequential(channel, payloads, references):
+    """Runs every structure against one server, timing each RPC call.
+
+    Returns the per-task timings, the energy of every structure and the
+    summed RPC time.
+    """
     results_data = {}
+    energies = {}
+    total_sequential_rpc_time = 0
+    for name, payload in payloads.items():
+        print(f"\nProcessing {name}...")
+        _, local_time = references[name]
+
+        # Time the remote RPC call
+        t0 = time.monotonic()
+        energies[name] = await run_single_calculation(channel, payload, name)
+        rpc_time = time.monotonic() - t0
+        total_sequential_rpc_time += rpc_time
+
+        print(f"  Local ASE call took: {local_time * 1000:.2f} ms")
+        print(f"  Remote RPC call took: {rpc_time * 1000:.2f} ms")
+
+        results_data[name] = {
+            "local_time_ms": local_time * 1000,
+            "rpc_time_ms": rpc_time * 1000,
+        }
+    return results_data, energies, total_sequential_rpc_time
+
+
+def check_parallel_energies(parallel_energies, sequential_energies):
+    """Returns the structures whose parallel energy differs from the sequential one.
+
+    A structure counts as mismatched when either phase got no energy for it.
+    """
+    return [
+        name
+        for name, energy in sequential_energies.items()
+        if energy is None
+        or parallel_energies.get(name) is None
+        or not np.isclose(parallel_energies[name], energy)
+    ]
+
+
+async def run_parallel(pool, payloads, max_inflight, batch_size=1):
+    """Spreads the structures round-robin over all servers and runs them concurrently.
+
+    At most ``max_inflight`` requests are outstanding; as soon as one
+    completes the next queued request takes its slot. Results are
+    collected in completion order rather than waiting on the slowest.
+    With ``batch_size`` above one, every request is a calculateBatch call
+    carrying that many structures.
+    """
+    slots = asyncio.Semaphore(max_inflight)
+    items = list(payloads.items())
+    batches = [items[i : i + batch_size] for i in range(0, len(items), batch_size)]
+
+    async def submit(batch):
+        async with slots:
+            if batch_size == 1:
+                name, payload = batch[0]
+                return [
+                    (name, await run_single_calculation(pool.next(), payload, name))
+                ]
+            return await run_batch_calculation(pool.next(), batch)
+
+    results = {}
+    for finished in asyncio.as_completed([submit(batch) for batch in batches]):
+        results.update(await finished)
+    return results
+
+
+async def main(
+    hosts,
+    sleep_ms,
+    connections_per_host=1,
+    inflight_per_server=2,
+    batch_size=1,
+    plot=True,
+    json_path=None,
+):
+    """Main coroutine to orchestrate sequential and parallel calculations."""
+    # Connect once to every server so connection setup is kept out of both
+    # the sequential baseline and the parallel measurement.
+    pool, failures = await CapnpChannelPool.connect_reachable(
+        hosts, connections_per_host
+    )
+    for host, port, e in failures:
+        print(f"  => RPC Error connecting to {host}:{port}: {e}")
+    if not pool:
+        print("No RPC server reachable, nothing to run.")
+        return
+    servers = {(channel.host, channel.port) for channel in pool}
 
     # 1. Create a workload using ASE
     print("--- Creating ASE structures for workload ---")
@@ -149,58 +314,36 @@ async def main(hosts, sleep_ms):
     for name, atoms in structures.items():
         atoms.set_cell([90, 90, 90])
         atoms.center()
+    payloads = structures_to_payloads(structures)
 
     print(f"Generated {len(structures)} structures to calculate.\n")
 
+    # ASE reference energies are computed once, outside every timed region
+    references = await compute_reference_energies(structures)
+
     # 2. Run sequentially for detailed timing and correctness check
     print(
-        f"--- Running {len(structures)} calculations sequentially on {hosts[0]} for detailed timing ---"
+        f"--- Running {len(structures)} calculations sequentially on {pool[0].host}:{pool[0].port} for detailed timing ---"
+    )
+    results_data, sequential_energies, total_sequential_rpc_time = await run_sequential(
+        pool[0], payloads, references
     )
-    ase_lj_calc = LennardJones()
-    total_sequential_rpc_time = 0
-    for name, atoms in structures.items():
-        print(f"\nProcessing {name}...")
-        atoms.calc = ase_lj_calc
-
-        # Time the local ASE call including the simulated workload
-        t0 = time.monotonic()
-        ref_energy = atoms.get_potential_energy()
-        t1 = time.monotonic()
-        local_time = t1 - t0
-
-        # Time the remote RPC call
-        host, port = server_addresses[0]
-        t2 = time.monotonic()
-        rpc_result = await run_single_calculation(host, int(port), atoms, name)
-        t3 = time.monotonic()
-        rpc_time = t3 - t2
-        total_sequential_rpc_time += rpc_time
-
-        print(f"  Local ASE call took: {local_time * 1000:.2f} ms")
-        print(f"  Remote RPC call took: {rpc_time * 1000:.2f} ms")
-
-        results_data[name] = {
-            "local_time_ms": local_time * 1000,
-            "rpc_time_ms": rpc_time * 1000,
-        }
     print(
         f"\nTotal sequential RPC execution took: {total_sequential_rpc_time:.4f} seconds\n"
     )
 
     # 3. Run calculations in parallel for speed-up measurement
     print(
-        f"--- Running {len(structures)} calculations in parallel across {len(hosts)} servers ---"
+        f"--- Running {len(structures)} calculations in parallel across {len(servers)} servers ---"
     )
     start_time_para = time.monotonic()
-    tasks = []
-    for i, (name, atoms) in enumerate(structures.items()):
-        host, port = server_addresses[i % len(server_addresses)]
-        task = asyncio.create_task(run_single_calculation(host, int(port), atoms, name))
-        tasks.append(task)
-    await asyncio.gather(*tasks)
+    parallel_energies = await run_parallel(
+        pool, payloads, len(servers) * inflight_per_server, batch_size
+    )
     end_time_para = time.monotonic()
     total_time_para = end_time_para - start_time_para
     print(f"\nParallel execution took: {total_time_para:.4f} seconds\n")
+    mismatched = check_parallel_energies(parallel_energies, sequential_energies)
 
     # 4. Show the results and create plots
     print("--- Summary ---")
@@ -209,15 +352,39 @@ async def main(hosts, sleep_ms):
     if total_time_para > 0:
         speedup = total_sequential_rpc_time / total_time_para
         print(f"Speed-up:                  {speedup:.2f}x")
-
-    create_timing_plot(results_data)
+    if mismatched:
+        print(f"Parallel energies differ from sequential for: {', '.join(mismatched)}")
+    else:
+        print("Parallel energies match the sequential run.")
+
+    if json_path:
+        with open(json_path, "w") as fh:
+            json.dump(
+                {
+                    "per_task": results_data,
+                    "sequential_rpc": total_sequential_rpc_time,
+                    "parallel": total_time_para,
+                },
+                fh,
+                indent=2,
+            )
+    if plot:
+        create_timing_plot(results_data, sleep_ms)
 
 
 if __name__ == "__main__":
     args = parse_args()
     try:
-        main_coro = main(args.hosts, args.sleep_ms)
-        asyncio.run(capnp.run(main_coro))
+        main_coro = main(
+            args.hosts,
+            args.sleep_ms,
+            connections_per_host=args.connections_per_host,
+            inflight_per_server=args.inflight_per_server,
+            batch_size=args.batch_size,
+            plot=not args.no_plot,
+            json_path=args.json,
+        )
+        run_capnp(main_coro)
     except KeyboardInterrupt:
         print("\nClient stopped by user.")
     except Exception as e:
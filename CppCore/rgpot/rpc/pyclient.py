@@ -65,10 +65,10 @@ async def main(connection):
     response = calculator.calculate(force_input)
 
     # Await and print the result
-    result = await response
-    result_dict = result.to_dict()
-    print("Energy:", result_dict["result"]["energy"])
-    print("Forces:", result_dict["result"]["forces"])
+    # Read the fields directly; to_dict() would convert the whole response tree
+    result = (await response).result
+    print("Energy:", result.energy)
+    print("Forces:", list(result.forces))
 
 
 async def cmd_main(host):
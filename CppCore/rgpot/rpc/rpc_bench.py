@@ -0,0 +1,139 @@
+"""RPC benchmark phase shared by the local-vs-RPC comparison scripts.
+
+Both ``py_comp_multiprocess.py`` and ``py_mpi_comp.py`` time the same RPC
+workload against a server pool; only their local baseline differs.
+"""
+
+import asyncio
+import time
+
+from rpc_pool import CapnpChannelPool
+
+
+def add_benchmark_options(parser):
+    """Adds the ``--batch``, ``--no-plot`` and ``--json`` options to ``parser``."""
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Send each server its share of the structures in one calculateBatch RPC.",
+    )
+    parser.add_argument(
+        "--no-plot",
+        action="store_true",
+        help="Skip plotting; matplotlib is then never imported.",
+    )
+    parser.add_argument(
+        "--json",
+        metavar="PATH",
+        help="Write the measured timings to PATH as JSON.",
+    )
+    return parser
+
+
+def load_pyplot():
+    """Imports ``matplotlib.pyplot`` only once a plot is actually requested.
+
+    Keeps matplotlib's import cost out of the benchmark itself.
+    """
+    import matplotlib.pyplot as plt
+
+    return plt
+
+
+def send_rpc_calculation(channel, payload):
+    """Sends one calculate request on a pooled channel without awaiting the reply."""
+    # The prebuilt ForceInput is copied into the request by pycapnp in C++.
+    request = channel.calculator.calculate_request()
+    request.fip = payload
+    return request.send()
+
+
+async def receive_rpc_calculation_async(channel, pending, structure_name):
+    """Awaits one in-flight calculate request and returns (name, energy)."""
+    host, port = channel.host, channel.port
+    try:
+        response = await pending
+        energy = response.result.energy
+        print(
+            f"  => RPC Result from {host}:{port} for {structure_name}: Energy = {energy:.4f}"
+        )
+        return structure_name, energy
+    except Exception as e:
+        print(f"  => RPC Error for {structure_name} on {host}:{port}: {e}")
+        return structure_name, None
+
+
+async def run_batched_rpc_calculation_async(channel, shard):
+    """Sends every structure of ``shard`` to one server in a single calculateBatch call."""
+    host, port = channel.host, channel.port
+    names = [name for name, _ in shard]
+    try:
+        request = channel.calculator.calculateBatch_request()
+        inputs = request.init("inputs", len(shard))
+        for i, (_, payload) in enumerate(shard):
+            inputs[i] = payload
+        response = await request.send()
+        energies = [result.energy for result in response.results]
+        for name, energy in zip(names, energies):
+            print(
+                f"  => RPC Result from {host}:{port} for {name}: Energy = {energy:.4f}"
+            )
+        return list(zip(names, energies))
+    except Exception as e:
+        print(f"  => RPC Error for batch {names} on {host}:{port}: {e}")
+        return [(name, None) for name in names]
+
+
+async def drain_shard_async(channel, shard):
+    """Pipelines one server's share of the structures over its channel.
+
+    Every request is sent before any reply is awaited, so building request
+    N+1 overlaps with request N being on the wire or in the server.
+    """
+    pending = [
+        (name, send_rpc_calculation(channel, payload)) for name, payload in shard
+    ]
+    return [
+        await receive_rpc_calculation_async(channel, promise, name)
+        for name, promise in pending
+    ]
+
+
+async def run_all_rpc_calculations_concurrently(pool, payloads, batch=False):
+    """Runs every payload against the servers of ``pool``; returns ``{name: energy}``.
+
+    ``payloads`` maps each structure name to its prebuilt ForceInput.
+    """
+    if not pool:
+        for name in payloads:
+            print(f"  => RPC Error for {name}: no RPC server reachable")
+        return dict.fromkeys(payloads)
+    # Shard the structures round-robin up front, one coroutine per server, so
+    # each connection only carries its own share instead of all tasks
+    # contending for every socket.
+    items = list(payloads.items())
+    shards = [items[i :: len(pool)] for i in range(len(pool))]
+    # With --batch each shard is a single calculateBatch round trip.
+    run_shard = run_batched_rpc_calculation_async if batch else drain_shard_async
+    async with asyncio.TaskGroup() as tg:
+        tasks = [
+            tg.create_task(run_shard(channel, shard))
+            for channel, shard in zip(pool, shards)
+        ]
+    return dict(pair for task in tasks for pair in task.result())
+
+
+async def time_rpc_benchmark(hosts, payloads, batch=False):
+    """Main coroutine for the RPC benchmark; returns ``(results, seconds)``.
+
+    The pool is connected, and the event loop already running, before the
+    clock starts, just as the local baselines start their workers before
+    timing. Only dispatching the calculations and collecting the replies
+    is measured.
+    """
+    pool, failures = await CapnpChannelPool.connect_reachable(hosts)
+    for host, port, e in failures:
+        print(f"  => RPC Error connecting to {host}:{port}: {e}")
+    start = time.monotonic()
+    results = await run_all_rpc_calculations_concurrently(pool, payloads, batch)
+    return results, time.monotonic() - start
@@ -0,0 +1,147 @@
+"""Persistent Cap'n Proto connections shared by the Python RPC client scripts.
+
+Opening a ``TwoPartyClient`` costs a TCP handshake plus a bootstrap round
+trip, so the clients connect to every server once up front and dispatch all
+calculations over those long-lived channels.
+"""
+
+import asyncio
+import itertools
+import socket
+from dataclasses import dataclass
+
+import capnp
+import Potentials_capnp
+
+
+@dataclass(slots=True)
+class Channel:
+    """A connected server with its bootstrapped Potential capability."""
+
+    host: str
+    port: int
+    client: capnp.TwoPartyClient
+    calculator: object
+
+
+def parse_endpoints(hosts):
+    """Parses ``HOST:PORT`` strings into ``(host, port)`` tuples once up front."""
+    endpoints = []
+    for entry in hosts:
+        host, _, port = entry.rpartition(":")
+        endpoints.append((host, int(port)))
+    return endpoints
+
+
+async def connect_socket(host, port):
+    """Opens a non-blocking TCP_NODELAY socket to the first reachable address.
+
+    Every address ``host`` resolves to is tried in turn, as
+    ``loop.create_connection`` would. The kernel buffer sizes are left
+    alone so Linux keeps autotuning them for large messages.
+    """
+    loop = asyncio.get_running_loop()
+    infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    error = None
+    for family, type_, proto, _, address in infos:
+        sock = socket.socket(family, type_, proto)
+        try:
+            sock.setblocking(False)
+            # Each RPC is a single small message; never hold it back for Nagle.
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            await loop.sock_connect(sock, address)
+        except OSError as exc:
+            sock.close()
+            error = exc
+            continue
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+    raise error or OSError(f"getaddrinfo returned no addresses for {host}:{port}")
+
+
+async def open_channel(host, port):
+    """Connects to one server and bootstraps its Potential capability."""
+    sock = await connect_socket(host, port)
+    # pycapnp hands the socket to an asyncio transport, which already
+    # coalesces the segments of one message into a single buffered write.
+    connection = await capnp.AsyncIoStream.create_connection(sock=sock)
+    client = capnp.TwoPartyClient(connection)
+    calculator = client.bootstrap().cast_as(Potentials_capnp.Potential)
+    return Channel(host, port, client, calculator)
+
+
+def run_capnp(coro):
+    """Runs ``coro`` inside the pycapnp event loop, on uvloop when installed."""
+    try:
+        import uvloop
+    except ImportError:
+        return asyncio.run(capnp.run(coro))
+    return uvloop.run(capnp.run(coro))
+
+
+class CapnpChannelPool:
+    """Round-robin pool holding persistent channels to every server.
+
+    Must be created from inside the ``capnp.run`` event loop, since the
+    connections are bound to it.
+    """
+
+    def __init__(self, channels):
+        self._channels = list(channels)
+        self._rr = itertools.cycle(self._channels)
+
+    @classmethod
+    async def connect(cls, hosts, connections_per_host=1):
+        """Connects to every ``HOST:PORT`` entry of ``hosts`` concurrently.
+
+        With ``connections_per_host`` above one, each server gets that many
+        independent channels; they are ordered host by host within each
+        round, so round-robin still alternates between servers and ``pool[i]``
+        for ``i < len(hosts)`` is the first channel to ``hosts[i]``.
+        """
+        endpoints = parse_endpoints(hosts)
+        channels = await asyncio.gather(
+            *(
+                open_channel(host, port)
+                for _ in range(connections_per_host)
+                for host, port in endpoints
+            )
+        )
+        return cls(channels)
+
+    @classmethod
+    async def connect_reachable(cls, hosts, connections_per_host=1):
+        """Connects to every server that can be reached.
+
+        Returns the pool of reachable servers and a list of
+        ``(host, port, exception)`` for every connection that failed, so one
+        dead server does not abort a whole benchmark run. Channels are
+        ordered as in :meth:`connect`, minus the failed ones.
+        """
+        endpoints = parse_endpoints(hosts) * connections_per_host
+        outcomes = await asyncio.gather(
+            *(open_channel(host, port) for host, port in endpoints),
+            return_exceptions=True,
+        )
+        channels, failures = [], []
+        for (host, port), outcome in zip(endpoints, outcomes):
+            if isinstance(outcome, Exception):
+                failures.append((host, port, outcome))
+            else:
+                channels.append(outcome)
+        return cls(channels), failures
+
+    def next(self):
+        """Returns the next channel in round-robin order."""
+        return next(self._rr)
+
+    def __getitem__(self, index):
+        return self._channels[index]
+
+    def __len__(self):
+        return len(self._channels)
+
+    def __iter__(self):
+        return iter(self._channels)
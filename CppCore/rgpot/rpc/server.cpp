@@ -33,29 +33,20 @@ private:
   std::unique_ptr<rgpot::PotentialBase>
       m_potential; //!< The polymorphic potential engine.
 
-public:
-  /**
-   * @brief Constructor for GenericPotImpl.
-   * @param pot Ownership of a PotentialBase derived object.
-   */
-  GenericPotImpl(std::unique_ptr<rgpot::PotentialBase> pot)
-      : m_potential(std::move(pot)) {}
-
   /**
-   * @details
+   * @brief Evaluates a single configuration into a result builder.
+   *
    * This method performs the following translation steps:
-   * 1. Extracts the @c ForceInput (fip) from the RPC context.
-   * 2. Validates the size of the atomic number list.
-   * 3. Converts Cap'n Proto lists into native @c AtomMatrix and @c std::vector
+   * 1. Validates the size of the atomic number list.
+   * 2. Converts Cap'n Proto lists into native @c AtomMatrix and @c std::vector
    * types.
-   * 4. Executes the calculation via the @c PotentialBase virtual operator.
-   * 5. Populates the @c PotentialResult with energy and force data.
+   * 3. Executes the calculation via the @c PotentialBase virtual operator.
+   * 4. Populates the @c PotentialResult with energy and force data.
    *
-   * @param context The Cap'n Proto RPC call context.
-   * @return An asynchronous promise for completion.
+   * @param fip The input atomic configuration.
+   * @param pres The result builder to populate.
    */
-  kj::Promise<void> calculate(CalculateContext context) override {
-    auto fip = context.getParams().getFip();
+  void evaluate(ForceInput::Reader fip, PotentialResult::Builder pres) {
     const size_t numAtoms = fip.getPos().size() / 3;
 
     KJ_REQUIRE(fip.getAtmnrs().size() == numAtoms, "AtomNumbers size mismatch");
@@ -73,13 +64,49 @@ public:
     auto [energy, forces] =
         (*m_potential)(nativePositions, nativeAtomTypes, nativeBoxMatrix);
 
-    auto result = context.getResults();
-    auto pres = result.initResult();
     pres.setEnergy(energy);
 
     auto forcesList = pres.initForces(numAtoms * 3);
     rgpot::types::adapt::capnp::populateForcesToCapnp(forcesList, forces);
+  }
+
+public:
+  /**
+   * @brief Constructor for GenericPotImpl.
+   * @param pot Ownership of a PotentialBase derived object.
+   */
+  GenericPotImpl(std::unique_ptr<rgpot::PotentialBase> pot)
+      : m_potential(std::move(pot)) {}
+
+  /**
+   * @details
+   * Extracts the @c ForceInput (fip) from the RPC context and evaluates it
+   * into the @c PotentialResult of the response.
+   *
+   * @param context The Cap'n Proto RPC call context.
+   * @return An asynchronous promise for completion.
+   */
+  kj::Promise<void> calculate(CalculateContext context) override {
+    auto fip = context.getParams().getFip();
+    evaluate(fip, context.getResults().initResult());
+    return kj::READY_NOW;
+  }
 
+  /**
+   * @details
+   * Evaluates every @c ForceInput of the request in order, so a client can
+   * amortise one round trip over several configurations. Results are
+   * written into a list of the same length as the inputs.
+   *
+   * @param context The Cap'n Proto RPC call context.
+   * @return An asynchronous promise for completion.
+   */
+  kj::Promise<void> calculateBatch(CalculateBatchContext context) override {
+    auto inputs = context.getParams().getInputs();
+    auto results = context.getResults().initResults(inputs.size());
+    for (auto i : kj::indices(inputs)) {
+      evaluate(inputs[i], results[i]);
+    }
     return kj::READY_NOW;
   }
 };
@@ -15,7 +15,8 @@
 //!
 //! - `ForceInput` — positions, atomic numbers, simulation cell.
 //! - `PotentialResult` — energy and forces.
-//! - `Potential` interface — a single `calculate` RPC method.
+//! - `Potential` interface — the `calculate` RPC method and its
+//!   `calculateBatch` variant taking a list of inputs.
 //!
 //! ## Client
 //!
@@ -28,8 +29,8 @@
 //!
 //! [`server::rgpot_rpc_server_start`] accepts a `rgpot_potential_t` handle
 //! (callback-backed) and listens for incoming Cap'n Proto RPC connections.
-//! Each `calculate` call is dispatched to the callback. The server blocks the
-//! calling thread.
+//! Each `calculate` call (and every input of a `calculateBatch` call) is
+//! dispatched to the callback. The server blocks the calling thread.
 
 /// Re-export of the generated Cap'n Proto schema from the crate root.
 ///
@@ -1,8 +1,8 @@
 // MIT License
 // Copyright 2023--present rgpot developers
 
-//! Cap'n Proto RPC server that dispatches incoming `calculate` calls
-//! to a `rgpot_potential_t` callback.
+//! Cap'n Proto RPC server that dispatches incoming `calculate` and
+//! `calculateBatch` calls to a `rgpot_potential_t` callback.
 //!
 //! ## DLPack Integration
 //!
@@ -18,7 +18,7 @@ use std::os::raw::c_void;
 use tokio::runtime::Runtime;
 
 use crate::potential::{PotentialCallback, rgpot_potential_t};
-use crate::rpc::schema::potential;
+use crate::rpc::schema::{force_input, potential, potential_result};
 use crate::status::rgpot_status_t;
 use crate::tensor::{
     rgpot_tensor_cpu_f64_2d, rgpot_tensor_cpu_f64_matrix3, rgpot_tensor_cpu_i32_1d,
@@ -37,17 +37,16 @@ struct PotentialServer {
 unsafe impl Send for PotentialServer {}
 unsafe impl Sync for PotentialServer {}
 
-impl potential::Server for PotentialServer {
-    fn calculate(
-        &mut self,
-        params: potential::CalculateParams,
-        mut results: potential::CalculateResults,
-    ) -> capnp::capability::Promise<(), CapnpError> {
-        let fip = pry!(pry!(params.get()).get_fip());
-
-        let positions = pry!(fip.get_pos());
-        let atmnrs = pry!(fip.get_atmnrs());
-        let box_data = pry!(fip.get_box());
+impl PotentialServer {
+    /// Evaluate one `ForceInput` through the callback into `result_builder`.
+    fn evaluate(
+        &self,
+        fip: force_input::Reader,
+        mut result_builder: potential_result::Builder,
+    ) -> Result<(), CapnpError> {
+        let positions = fip.get_pos()?;
+        let atmnrs = fip.get_atmnrs()?;
+        let box_data = fip.get_box()?;
 
         let n_atoms = atmnrs.len() as usize;
 
@@ -95,12 +94,11 @@ impl potential::Server for PotentialServer {
         }
 
         if status != rgpot_status_t::RGPOT_SUCCESS {
-            return capnp::capability::Promise::err(CapnpError::failed(
+            return Err(CapnpError::failed(
                 "potential callback returned an error".to_string(),
             ));
         }
 
-        let mut result_builder = results.get().init_result();
         result_builder.set_energy(output.energy);
 
         let mut forces_builder = result_builder.init_forces(forces_copy.len() as u32);
@@ -108,6 +106,31 @@ impl potential::Server for PotentialServer {
             forces_builder.set(i as u32, f);
         }
 
+        Ok(())
+    }
+}
+
+impl potential::Server for PotentialServer {
+    fn calculate(
+        &mut self,
+        params: potential::CalculateParams,
+        mut results: potential::CalculateResults,
+    ) -> capnp::capability::Promise<(), CapnpError> {
+        let fip = pry!(pry!(params.get()).get_fip());
+        pry!(self.evaluate(fip, results.get().init_result()));
+        capnp::capability::Promise::ok(())
+    }
+
+    fn calculate_batch(
+        &mut self,
+        params: potential::CalculateBatchParams,
+        mut results: potential::CalculateBatchResults,
+    ) -> capnp::capability::Promise<(), CapnpError> {
+        let inputs = pry!(pry!(params.get()).get_inputs());
+        let mut results_builder = results.get().init_results(inputs.len());
+        for (i, fip) in inputs.iter().enumerate() {
+            pry!(self.evaluate(fip, results_builder.reborrow().get(i as u32)));
+        }
         capnp::capability::Promise::ok(())
     }
 }
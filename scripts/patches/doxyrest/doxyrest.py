@@ -9,9 +9,13 @@
 #
 #...............................................................................
 
+import functools
+import importlib.util
 import os
 import re
+import sys
 import warnings
+from pathlib import Path
 from packaging import version
 from docutils import nodes
 from docutils.parsers.rst import Directive, directives
@@ -27,23 +31,44 @@ from sphinx.domains import Domain
 
 sphinx_version = version.parse(sphinx_version_string)
 this_dir = os.path.dirname(os.path.realpath(__file__))
-url_re_prog = re.compile('(ftp|https?)://')
+url_prefixes = ('http://', 'https://', 'ftp://')
 crefdb = {}
+cref_miss_set = set() # warn only once per missing target
 cref_w_target_re_prog = re.compile('(.+?)\s*<([^<>]*)>$')
 
 def get_cref_target(text, target=None):
     if not target:
         target = text
-    elif url_re_prog.match(target):
+    elif target.startswith(url_prefixes):
         return target
 
     if target in crefdb:
         return crefdb[target]
 
-    warnings.warn('target not found for cref: ' + target, Warning, 2)
+    if target not in cref_miss_set:
+        cref_miss_set.add(target)
+        warnings.warn('target not found for cref: ' + target, Warning, 2)
+
     return None
 
+@functools.lru_cache(maxsize=None)
+def get_role_re_prog(role_re_src, is_role_optional, flags=0):
+    # the pattern only depends on default_role, so compile it once per config
+    if is_role_optional:
+        role_re_src += '?' # explicit role is optional
+
+    role_re_src += r'`(.+?)(\s*<([^<>]*)>)?`'
+    return re.compile(role_re_src, flags)
+
+@functools.lru_cache(maxsize=4096)
 def get_cref_target_ex(text):
+    # fast path for the common single-line 'text <target>' form
+    if text.endswith('>') and '\n' not in text:
+        head, sep, target = text[:-1].rpartition('<')
+        head = head.rstrip()
+        if sep and head and '>' not in target:
+            return get_cref_target(head, target), head
+
     match = cref_w_target_re_prog.match(text)
     if match:
         text = match.group(1)
@@ -90,14 +115,22 @@ def visit_doxyrest_block(self, node):
 def depart_doxyrest_block(self, node):
     self.body.append('</pre></div>\n')
 
+# opening tags for the common line numbers, built once instead of per line
+line_span_open_table = tuple(f'<span data-line="{i}">' for i in range(4096))
+
 def visit_doxyrest_line(self, node):
     lineno = node.get('lineno', '')
-    self.body.append(f'<span data-line="{lineno}">')
+    if isinstance(lineno, int) and 0 <= lineno < len(line_span_open_table):
+        self.body.append(line_span_open_table[lineno])
+    else:
+        self.body.append(f'<span data-line="{lineno}">')
 
 def depart_doxyrest_line(self, node):
     # CRITICAL FIX: Append \n so the <pre> block renders a line break
     self.body.append('</span>\n')
 
+data_line_re_prog = re.compile(r'^\s*(<span\s+[^>]*data-line=["\']\d+["\'][^>]*>)(.*)(</span>)\s*$', re.DOTALL)
+
 def cleanup_fragment(html):
     """
     Strips block-level wrappers (div, pre, data-line spans) from syntax-highlighted
@@ -106,11 +139,27 @@ def cleanup_fragment(html):
     if not html:
         return html
 
-    html = re.sub(r'^<div[^>]*>\s*<pre[^>]*>', '', html)
-    html = re.sub(r'</pre>\s*</div>$', '', html)
+    # leading <div ...><pre ...> wrapper
+    if html.startswith('<div'):
+        div_end = html.find('>')
+        if div_end != -1:
+            tail = html[div_end + 1:].lstrip()
+            if tail.startswith('<pre'):
+                pre_end = tail.find('>')
+                if pre_end != -1:
+                    html = tail[pre_end + 1:]
+
+    # trailing </pre></div> wrapper, possibly followed by a final newline
+    newline = '\n' if html.endswith('\n') else ''
+    head = html[:len(html) - len(newline)]
+    if head.endswith('</div>'):
+        head = head[:-len('</div>')].rstrip()
+        if head.endswith('</pre>'):
+            html = head[:-len('</pre>')] + newline
+
     html = html.replace('<span></span>', '')
 
-    match = re.match(r'^\s*(<span\s+[^>]*data-line=["\']\d+["\'][^>]*>)(.*)(</span>)\s*$', html, re.DOTALL)
+    match = data_line_re_prog.match(html)
     if match:
         html = match.group(2)
 
@@ -119,6 +168,16 @@ def cleanup_fragment(html):
 
     return html
 
+highlighter_map = {} # id -> highlighter; also keeps the ids from being reused
+
+@functools.lru_cache(maxsize=8192)
+def highlight_fragment(text, language, highlighter_id):
+    # the same short tokens are highlighted over and over again
+    options = {'nowrap': True}
+    highlighter = highlighter_map[highlighter_id]
+    highlighted = highlighter.highlight_block(text, language, options)
+    return cleanup_fragment(highlighted)
+
 def visit_highlighted_text_node(self, node):
     text_node = node.children[0]
     language = node['language']
@@ -126,10 +185,9 @@ def visit_highlighted_text_node(self, node):
     if language == 'none':
         self.body.append(text_node)
     else:
-        options = {'nowrap': True}
-        text = text_node
-        highlighted = self.highlighter.highlight_block(text, language, options)
-        clean_html = cleanup_fragment(highlighted)
+        highlighter_id = id(self.highlighter)
+        highlighter_map.setdefault(highlighter_id, self.highlighter)
+        clean_html = highlight_fragment(str(text_node), language, highlighter_id)
         self.body.append(clean_html)
 
     raise nodes.SkipNode
@@ -140,20 +198,23 @@ def create_ref_node(raw_text, text, target, highlight_language=None):
             return HighlightedText(text, text, language=highlight_language)
         return nodes.Text(text, text)
 
-    style_opts = {'style': 'text-decoration: underline'}
+    # set all attributes at construction instead of mutating the node afterwards
+    attributes = {
+        'classes': ['doxyrest-code-link'],
+        'style': 'text-decoration: underline'
+    }
 
-    if url_re_prog.match(target):
-        node = nodes.reference(raw_text, '', refuri=target, **style_opts)
+    if target.startswith(url_prefixes):
+        node = nodes.reference(raw_text, '', refuri=target, **attributes)
     else:
-        node = addnodes.pending_xref(raw_text)
-        node['reftype'] = 'ref'
-        node['refdomain'] = 'std'
-        node['reftarget'] = target
-        node['refwarn'] = True
-        node['refexplicit'] = True
-        node.attributes.update(style_opts)
-
-    node['classes'] += ['doxyrest-code-link']
+        node = addnodes.pending_xref(
+            raw_text,
+            reftype='ref',
+            refdomain='std',
+            reftarget=target,
+            refwarn=True,
+            refexplicit=True,
+            **attributes)
 
     if highlight_language:
         node += HighlightedText(text, text, language=highlight_language)
@@ -162,9 +223,27 @@ def create_ref_node(raw_text, text, target, highlight_language=None):
 
     return node
 
+def merge_highlighted_text(parts, language):
+    result = []
+    text = ''
+    for part in parts:
+        if isinstance(part, str):
+            text += part
+            continue
+
+        if text:
+            result.append(HighlightedText(text, text, language=language))
+            text = ''
+
+        result.append(part)
+
+    if text:
+        result.append(HighlightedText(text, text, language=language))
+
+    return result
+
 def create_target_node(raw_text, text, target, highlight_language, lineno, document, extra_classes=[]):
-    node = nodes.target(raw_text, '', ids=[target], names=[target])
-    node['classes'] += extra_classes
+    node = nodes.target(raw_text, '', ids=[target], names=[target], classes=list(extra_classes))
     node.line = lineno
     document.note_explicit_target(node)
 
@@ -203,12 +282,10 @@ class RefCodeBlock(Directive):
     def __init__(self, *args, **kwargs):
         Directive.__init__(self, *args, **kwargs)
 
-        role_re_src = '(:ref:|:cref:|:target:)'
-        if self.state.document.settings.env.config.default_role == 'cref':
-            role_re_src += '?' # explicit role is optional
-
-        role_re_src += '`(.+?)(\s*<([^<>]*)>)?`'
-        self.role_re_prog = re.compile(role_re_src, re.DOTALL)
+        self.role_re_prog = get_role_re_prog(
+            '(:ref:|:cref:|:target:)',
+            self.state.document.settings.env.config.default_role == 'cref',
+            re.DOTALL)
 
     def run(self):
         config = self.state.document.settings.env.config
@@ -233,18 +310,18 @@ class RefCodeBlock(Directive):
                 block_node += line_node
                 continue
 
+            # Fast path: every role needs a backtick, most code lines have none
+            if '`' not in line:
+                line_node += HighlightedText(line, line, language=language)
+                block_node += line_node
+                continue
+
+            # plain code is collected as str so adjacent chunks are
+            # highlighted as one HighlightedText node
+            parts = []
             pos = 0
-            while True:
-                match = self.role_re_prog.search(line, pos)
-                if match is None:
-                    chunk = line[pos:]
-                    if chunk:
-                        line_node += HighlightedText(chunk, chunk, language=language)
-                    break
-
-                pre_text = line[pos:match.start()]
-                if pre_text:
-                    line_node += HighlightedText(pre_text, pre_text, language=language)
+            for match in self.role_re_prog.finditer(line):
+                parts.append(line[pos:match.start()])
 
                 raw_text = match.group(0)
                 role = match.group(1)
@@ -256,16 +333,24 @@ class RefCodeBlock(Directive):
 
                 if role == ':target:':
                     if not target: target = text
-                    line_node += create_target_node(raw_text, text, target, language, None, self.state.document, ['doxyrest-code-target'])
+                    parts += create_target_node(raw_text, None, target, language, None, self.state.document, ['doxyrest-code-target'])
+                    parts.append(text)
                 else:
                     if not role or role == ':cref:':
                         target = get_cref_target(text, target)
                     elif not target:
                         target = text
-                    line_node += create_ref_node(raw_text, text, target, language)
+
+                    if target:
+                        parts.append(create_ref_node(raw_text, text, target, language))
+                    else:
+                        parts.append(text)
 
                 pos = match.end()
 
+            parts.append(line[pos:])
+            line_node += merge_highlighted_text(parts, language)
+
             block_node += line_node
 
         self.add_name(block_node)
@@ -280,58 +365,61 @@ class RefCodeBlock(Directive):
 class RefTransform(Transform):
     default_priority = 100
 
-    node_classes = {
+    node_classes = (
         nodes.literal,
         nodes.strong,
         nodes.emphasis
-    }
+    )
 
     def __init__(self, document, startnode=None):
         Transform.__init__(self, document, startnode)
 
-        re_src = '(:c?ref:)'
-        if document.settings.env.config.default_role == 'cref':
-            re_src += '?' # explicit role is optional
+        self.is_role_optional = document.settings.env.config.default_role == 'cref'
+        self.re_prog = get_role_re_prog('(:c?ref:)', self.is_role_optional)
 
-        re_src += '`(.+?)(\s*<([^<>]*)>)?`'
-        self.re_prog = re.compile(re_src)
-
-    @staticmethod
-    def node_filter(node):
+    def apply(self):
+        # every match needs backticks, and an explicit role unless optional;
+        # most documents contain neither, so skip the traversal altogether
+        markers = ('`',) if self.is_role_optional else (':ref:', ':cref:')
+        document_text = self.document.astext()
+        if not any(marker in document_text for marker in markers):
+            return
+
+        # findall (docutils >= 0.18) is the non-deprecated traverse; a class
+        # condition is a plain isinstance check instead of a filter call per node
+        find = getattr(self.document, 'findall', self.document.traverse)
         for node_class in RefTransform.node_classes:
-            if isinstance (node, node_class):
-                return node['classes'] == []
+            for node in list(find(node_class)):
+                if not node['classes']:
+                    self.apply_to_node(node)
 
-        return False
+    def apply_to_node(self, node):
+        code = node.astext()
+        if '`' not in code:
+            return
 
-    def apply(self):
-        for node in self.document.traverse(RefTransform.node_filter):
-            code = node.astext()
-            node.children = []
-            pos = 0
+        node.children = []
+        pos = 0
 
-            while True:
-                match = self.re_prog.search(code, pos)
-                if match is None:
-                    plain_text = code[pos:]
-                    if plain_text != "":
-                        node += nodes.Text(plain_text, plain_text)
-                    break
+        for match in self.re_prog.finditer(code):
+            plain_text = code[pos:match.start()]
+            if plain_text != "":
+                node += nodes.Text(plain_text, plain_text)
 
-                plain_text = code[pos:match.start()]
-                if plain_text != "":
-                    node += nodes.Text(plain_text, plain_text)
+            raw_text = match.group(0)
+            role = match.group(1)
+            text = match.group(2)
+            target = match.group(4)
 
-                raw_text = match.group(0)
-                role = match.group(1)
-                text = match.group(2)
-                target = match.group(4)
+            if not role or role == ':cref:':
+                target = get_cref_target(text, target)
 
-                if not role or role == ':cref:':
-                    target = get_cref_target(text, target)
+            node += create_ref_node(raw_text, text, target)[0] # Take first node
+            pos = match.end()
 
-                node += create_ref_node(raw_text, text, target)[0] # Take first node
-                pos = match.end()
+        plain_text = code[pos:]
+        if plain_text != "":
+            node += nodes.Text(plain_text, plain_text)
 
 
 #...............................................................................
@@ -402,9 +490,8 @@ if not is_sphinx_tab_aware:
             tab_width = self.env.config.doxyrest_tab_width
             lines = string2lines(inputstring, convert_whitespace=True, tab_width=tab_width)
 
-            content = StringList()
-            for lineno, line in enumerate(lines):
-                content.append(line, self.source_path, lineno)
+            # items default to (source_path, lineno) for every line
+            content = StringList(lines, self.source_path)
 
             if self.env.config.rst_prolog:
                 self.prepend_prolog(content, self.env.config.rst_prolog)
@@ -426,6 +513,30 @@ if not is_sphinx_tab_aware:
 #  Sphinx events
 #
 
+crefdb_cache = {} # path -> (mtime, crefdb)
+
+def load_crefdb(crefdb_path):
+    # crefdb.py files are large and rarely change between incremental builds
+    mtime = crefdb_path.stat().st_mtime
+    cached = crefdb_cache.get(crefdb_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    spec = importlib.util.spec_from_file_location('crefdb', crefdb_path)
+    module = importlib.util.module_from_spec(spec)
+
+    # crefdb.py lives in the user's documentation tree; never leave a
+    # __pycache__ behind in it
+    dont_write_bytecode = sys.dont_write_bytecode
+    sys.dont_write_bytecode = True
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.dont_write_bytecode = dont_write_bytecode
+
+    crefdb_cache[crefdb_path] = (mtime, module.crefdb)
+    return module.crefdb
+
 def on_builder_inited(app):
     app.config.html_static_path += [
         this_dir + '/css/doxyrest-pygments.css',
@@ -446,38 +557,33 @@ def on_builder_inited(app):
         app.config.html_static_path += [this_dir + '/css/' + css_file];
         add_css_file(app, css_file);
 
-    for basedir, dirnames, filenames in os.walk(app.srcdir):
-        if 'crefdb.py' in filenames:
-            crefdb_path = os.path.join(basedir, 'crefdb.py')
-            src = open(crefdb_path).read()
-            ns = {}
-            exec(src, ns)
-            new_crefdb = ns['crefdb']
-            if isinstance(new_crefdb, dict):
-                global crefdb
-                crefdb.update(new_crefdb)
+    for crefdb_path in Path(app.srcdir).rglob('crefdb.py'):
+        new_crefdb = load_crefdb(crefdb_path)
+        if isinstance(new_crefdb, dict):
+            global crefdb
+            crefdb.update(new_crefdb)
+
+    # results resolved against the previous crefdb are stale now
+    get_cref_target_ex.cache_clear()
 
 def on_config_inited(app, config):
-    docutils_conf_in_path = this_dir + '/conf/doxyrest-docutils.conf.in'
-    docutils_conf_path = app.doctreedir + '/doxyrest-docutils.conf'
+    docutils_conf_in_path = Path(this_dir) / 'conf' / 'doxyrest-docutils.conf.in'
+    docutils_conf_path = Path(app.doctreedir) / 'doxyrest-docutils.conf'
 
-    src_file = open(docutils_conf_in_path, 'r')
-    contents = src_file.read()
+    contents = docutils_conf_in_path.read_text()
     contents = contents.replace('%tab_width%', str(config.doxyrest_tab_width))
-    src_file.close()
 
-    if not os.path.exists(app.doctreedir):
-        os.makedirs(app.doctreedir)
+    docutils_conf_path.parent.mkdir(parents=True, exist_ok=True)
 
-    dst_file = open(docutils_conf_path, 'w')
-    dst_file.write(contents)
-    dst_file.close()
+    # leave an up-to-date file alone instead of rewriting it on every build
+    if not docutils_conf_path.exists() or docutils_conf_path.read_text() != contents:
+        docutils_conf_path.write_text(contents)
 
     if 'DOCUTILSCONFIG' in os.environ:
         prev_docutils_conf = os.environ['DOCUTILSCONFIG']
-        os.environ['DOCUTILSCONFIG'] = docutils_conf_path + os.pathsep + prev_docutils_conf
+        os.environ['DOCUTILSCONFIG'] = str(docutils_conf_path) + os.pathsep + prev_docutils_conf
     else:
-        os.environ['DOCUTILSCONFIG'] = docutils_conf_path
+        os.environ['DOCUTILSCONFIG'] = str(docutils_conf_path)
 
 #...............................................................................
 #
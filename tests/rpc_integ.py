@@ -4,6 +4,7 @@ import argparse
 import subprocess
 import sys
 import os
+import tempfile
 import capnp
 import numpy as np
 
@@ -13,6 +14,17 @@ SCHEMA_PATH = os.path.join(SCRIPT_DIR, "../CppCore/rgpot/rpc/Potentials.capnp")
 pot_capnp = capnp.load(SCHEMA_PATH)
 
 
+def _build_force_input(pos, atmnrs, box):
+    """Builds a ForceInput message from flat pos and atmnrs lists and a 3x3 box."""
+    fip = pot_capnp.ForceInput.new_message()
+    # Whole-list assignment fills each field in one call instead of one
+    # schema-dispatched __setitem__ per element
+    fip.pos = pos
+    fip.atmnrs = atmnrs
+    fip.box = box.ravel().tolist()
+    return fip
+
+
 async def run_client(port):
     # Retry connection a few times to allow server startup
     for _ in range(10):
@@ -31,42 +43,65 @@ async def run_client(port):
     client = capnp.TwoPartyClient(connection)
     pot = client.bootstrap().cast_as(pot_capnp.Potential)
 
-    # Test Case: CuH2 minimal system
-    fip = pot_capnp.ForceInput.new_message()
-
-    # Cu at 0,0,0 and H at 1.5, 0, 0 (Approx distance)
-    # Using semantic types from your "Pro" schema if you applied it,
-    # but based on your recent "simple" checks, we'll stick to the flat list
-    # unless you updated the schema.
-    # Assuming you kept the struct/flat hybrid from previous steps:
-    pos_data = [0.0, 0.0, 0.0, 1.5, 0.0, 0.0]
-    fip.init("pos", len(pos_data))
-    for i, p in enumerate(pos_data):
-        fip.pos[i] = p
-
-    fip.init("atmnrs", 2)
-    fip.atmnrs[0] = 29  # Cu
-    fip.atmnrs[1] = 1  # H
-
-    box_data = [10.0, 0.0, 0.0, 0.0, 10.0, 0.0, 0.0, 0.0, 10.0]
-    fip.init("box", len(box_data))
-    for i, b in enumerate(box_data):
-        fip.box[i] = b
-
-    print("Sending calculation request...")
-    # This await requires the KJ loop
-    result = await pot.calculate(fip)
-
-    print(f"Received Energy: {result.result.energy}")
-    print(f"Received Forces: {list(result.result.forces)}")
-    assert result.result.energy == -0.67880756881223303
-    assert result.result.forces[0] == -7.556524918281001
-    assert result.result.forces[3] == 7.556524918281001
-
-    # Basic physical sanity check
-    if result.result.energy == 0.0 or np.isnan(result.result.energy):
-        print("Error: Energy is zero or NaN")
-        return False
+    # (payload, expected energy, expected forces by index)
+    cases = [
+        # Test Case: CuH2 minimal system
+        # Cu at 0,0,0 and H at 1.5, 0, 0 (Approx distance)
+        (
+            _build_force_input(
+                pos=[0.0, 0.0, 0.0, 1.5, 0.0, 0.0],
+                atmnrs=[29, 1],  # Cu, H
+                box=np.diag([10.0, 10.0, 10.0]),
+            ),
+            -0.67880756881223303,
+            {0: -7.556524918281001, 3: 7.556524918281001},
+        ),
+    ]
+
+    print(f"Sending {len(cases)} calculation request(s)...")
+    # All requests share the one connection and are in flight together;
+    # this await requires the KJ loop
+    results = await asyncio.gather(*(pot.calculate(fip) for fip, _, _ in cases))
+
+    for result, (_, energy, forces) in zip(results, cases):
+        print(f"Received Energy: {result.result.energy}")
+        print(f"Received Forces: {list(result.result.forces)}")
+        assert result.result.energy == energy
+        for i, force in forces.items():
+            assert result.result.forces[i] == force
+
+        # Basic physical sanity check
+        if result.result.energy == 0.0 or np.isnan(result.result.energy):
+            print("Error: Energy is zero or NaN")
+            return False
+
+    # calculateBatch must return exactly what separate calculate calls give,
+    # one result per input and in input order; the H distances differ so a
+    # reordering would show up as an energy mismatch
+    batch_inputs = [
+        _build_force_input(
+            pos=[0.0, 0.0, 0.0, h_x, 0.0, 0.0],
+            atmnrs=[29, 1],  # Cu, H
+            box=np.diag([10.0, 10.0, 10.0]),
+        )
+        for h_x in (1.5, 1.7, 2.0)
+    ]
+    singles = await asyncio.gather(*(pot.calculate(fip) for fip in batch_inputs))
+    single_energies = [single.result.energy for single in singles]
+    assert len(set(single_energies)) == len(single_energies)
+
+    print(f"Sending calculateBatch request with {len(batch_inputs)} inputs...")
+    request = pot.calculateBatch_request()
+    inputs = request.init("inputs", len(batch_inputs))
+    for i, fip in enumerate(batch_inputs):
+        inputs[i] = fip
+    batch = await request.send()
+
+    assert len(batch.results) == len(batch_inputs)
+    for single, result in zip(singles, batch.results):
+        print(f"Received Batch Energy: {result.energy}")
+        assert result.energy == single.result.energy
+        assert list(result.forces) == list(single.result.forces)
 
     return True
 
@@ -80,11 +115,15 @@ def main():
     args = parser.parse_args()
 
     # 1. Start Server
+    # Log to files rather than pipes: nobody drains a pipe while the client
+    # runs, so a chatty server could block on a full pipe buffer
+    server_out = tempfile.TemporaryFile()
+    server_err = tempfile.TemporaryFile()
     print(f"Starting server: {args.server_bin} {args.port} CuH2")
     server_proc = subprocess.Popen(
         [args.server_bin, str(args.port), "CuH2"],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
+        stdout=server_out,
+        stderr=server_err,
     )
 
     try:
@@ -94,13 +133,16 @@ def main():
         print(f"Exception during test: {e}")
         # Print server stderr to help debug
         print("Server stderr:")
-        print(server_proc.stderr.read().decode())
+        server_err.seek(0)
+        print(server_err.read().decode())
         success = False
     finally:
         # Cleanup
         print("Killing server...")
         server_proc.kill()
-        server_proc.wait()
+        server_proc.communicate(timeout=5)
+        server_out.close()
+        server_err.close()
 
     if not success:
         sys.exit(1)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""Checks rpc_marshal's NumPy wire-format encoder against pycapnp's builder."""
+import os
+import sys
+
+import numpy as np
+
+# rpc_marshal and the Potentials.capnp schema it imports live next to the
+# client scripts
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(SCRIPT_DIR, "../CppCore/rgpot/rpc"))
+
+from rpc_marshal import encode_force_input, soa_to_force_input  # noqa: E402
+
+# Odd atom counts leave a padding Int32 at the end of atmnrs; 1024 and up
+# are the sizes build_payloads actually routes through the encoder
+ATOM_COUNTS = [0, 1, 2, 3, 5, 1024, 1025, 3000]
+
+
+def check_encoder(natoms, rng):
+    pos = rng.uniform(-10.0, 10.0, 3 * natoms)
+    numbers = rng.integers(1, 119, natoms, dtype=np.int32)
+    cell = rng.uniform(0.0, 30.0, 9)
+
+    expected = soa_to_force_input(pos, numbers, cell).to_segments()
+    encoded = encode_force_input(pos, numbers, cell)
+    if [encoded] != list(expected):
+        print(f"Error: encoder output differs from pycapnp for {natoms} atoms")
+        return False
+    return True
+
+
+def main():
+    rng = np.random.default_rng(42)
+    failed = [natoms for natoms in ATOM_COUNTS if not check_encoder(natoms, rng)]
+    if failed:
+        print(f"Encoder mismatch for atom counts: {failed}")
+        sys.exit(1)
+    print("rpc_marshal encoder test passed.")
+
+
+if __name__ == "__main__":
+    main()